@@ -0,0 +1,38 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2.pool
+
+# Connection parameters shared by all scripts
+db_params = {
+    "dbname": "gisdb",
+    "user": "admin",
+    "password": "admin",
+    "host": "localhost",
+    "port": 5432
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(minconn=1, maxconn=16, **db_params)
+    return _pool
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection for the duration of a with block.
+
+    The connection goes back to the pool on exit; psycopg2 rolls back any
+    transaction still open, so commit before leaving the block.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
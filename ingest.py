@@ -1,16 +1,65 @@
-import psycopg2
+import ijson
+import csv
+import io
+import itertools
 import json
 import os
+from contextlib import contextmanager
 from pprint import pprint
+from shapely import wkb
+from shapely.geometry import shape
 
-# Connection parameters
-db_params = {
-    "dbname": "gisdb",
-    "user": "admin",
-    "password": "admin",
-    "host": "localhost",
-    "port": 5432
-}
+from db import get_conn
+
+# NULL marker declared on the staging COPY; only an unquoted field matches it,
+# so quoted strings (empty or a literal \N) stay strings
+COPY_NULL = '\\N'
+
+# Rows sent per COPY round-trip; PostgreSQL gains little from larger batches
+BATCH_SIZE = 1000
+
+# Features scanned when inferring column types from property values
+TYPE_SAMPLE_SIZE = 1000
+
+# Column types in promotion order (bool < int < float < str); a column takes
+# the highest rank seen across the sample
+RANKED_SQL_TYPES = ["BOOLEAN", "INTEGER", "DOUBLE PRECISION", "TEXT"]
+EVENT_TYPE_RANKS = {'boolean': 0, 'string': 3, 'start_map': 3, 'start_array': 3}
+
+class _CopyNull:
+    """Staging-CSV field for a missing value.
+
+    The staging writer quotes every non-numeric field; this marker passes
+    csv's numeric check, so it is the one field written as a bare COPY_NULL.
+    """
+    
+    def __float__(self):
+        return 0.0
+    
+    def __str__(self):
+        return COPY_NULL
+
+_NULL_FIELD = _CopyNull()
+
+class _Utf8Reader:
+    """Minimal file-like wrapper that re-encodes a text stream as UTF-8 bytes."""
+    
+    def __init__(self, text_file):
+        self._text_file = text_file
+    
+    def read(self, size=-1):
+        return self._text_file.read(size).encode('utf-8')
+
+@contextmanager
+def open_geojson(file_path, encoding='utf-8'):
+    """Open a GeoJSON file as a UTF-8 byte stream for ijson."""
+    if encoding == 'utf-8':
+        with open(file_path, 'rb') as f:
+            yield f
+    else:
+        # ijson only parses UTF-8, so other encodings are re-encoded on the fly
+        with open(file_path, 'r', encoding=encoding) as f:
+            yield _Utf8Reader(f)
 
 def examine_geojson(file_path):
     """Examine the structure of a GeoJSON file and return details."""
@@ -20,35 +69,64 @@ def examine_geojson(file_path):
         
         for encoding in encodings_to_try:
             try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    data = json.load(f)
+                feature_count = 0
+                geometry_types = set()
+                crs_type = None
+                crs_name = None
+                type_ranks = {}
+                pending_key = None
+                
+                # Stream parse events so memory stays flat regardless of file size
+                with open_geojson(file_path, encoding) as f:
+                    for prefix, event, value in ijson.parse(f, use_float=True):
+                        # The event right after a property key carries its value
+                        if pending_key is not None:
+                            if event == 'number':
+                                rank = 1 if isinstance(value, int) else 2
+                            else:
+                                rank = EVENT_TYPE_RANKS.get(event, -1)
+                            type_ranks[pending_key] = max(type_ranks.get(pending_key, -1), rank)
+                            pending_key = None
+                        
+                        if prefix == 'features.item' and event == 'start_map':
+                            feature_count += 1
+                        elif prefix == 'features.item.geometry.type':
+                            geometry_types.add(value)
+                        elif prefix == 'crs.type':
+                            crs_type = value
+                        elif prefix == 'crs.properties.name':
+                            crs_name = value
+                        elif (prefix == 'features.item.properties' and event == 'map_key'
+                              and feature_count <= TYPE_SAMPLE_SIZE):
+                            pending_key = value
                 break
-            except UnicodeDecodeError:
+            except (UnicodeDecodeError, ijson.JSONError) as e:
+                # The C backend reports undecodable bytes as a lexical JSON error;
+                # any other parse error is a real one and is raised as is
+                if isinstance(e, ijson.JSONError) and 'invalid bytes in UTF8' not in str(e):
+                    raise
                 if encoding == encodings_to_try[-1]:
                     raise Exception(f"Could not decode file with any of these encodings: {encodings_to_try}")
                 continue
         
-        feature_count = len(data.get('features', []))
-        geometry_types = set()
         properties = None
         
         if feature_count > 0:
-            first_feature = data['features'][0]
-            properties = first_feature.get('properties', {})
-            
-            for feature in data['features']:
-                if 'geometry' in feature and 'type' in feature['geometry']:
-                    geometry_types.add(feature['geometry']['type'])
-        
-        geometry_type = None
-        if 'MultiPolygon' in geometry_types or ('Polygon' in geometry_types and 'MultiPolygon' in geometry_types):
-            geometry_type = 'MultiPolygon'
-        elif 'MultiLineString' in geometry_types or ('LineString' in geometry_types and 'MultiLineString' in geometry_types):
-            geometry_type = 'MultiLineString'
-        elif 'MultiPoint' in geometry_types or ('Point' in geometry_types and 'MultiPoint' in geometry_types):
-            geometry_type = 'MultiPoint'
-        elif geometry_types:
-            geometry_type = next(iter(geometry_types))
+            with open_geojson(file_path, encoding) as f:
+                properties = next(ijson.items(f, 'features.item.properties', use_float=True), None) or {}
+        
+        # Only named EPSG codes are understood; anything else is left to the caller
+        source_srid_hint = None
+        if crs_type == 'name' and crs_name and 'EPSG' in crs_name:
+            try:
+                source_srid_hint = int(crs_name.split(':')[-1])
+            except ValueError:
+                pass
+        
+        # Multi types win so mixed single/multi collections fit one column;
+        # single-part types all rank equally
+        precedence = {'MultiPolygon': 3, 'MultiLineString': 2, 'MultiPoint': 1}
+        geometry_type = max(geometry_types, key=lambda t: precedence.get(t, 0), default=None)
         
         print("\nGeoJSON Analysis:")
         print(f"Total features: {feature_count}")
@@ -57,16 +135,55 @@ def examine_geojson(file_path):
         print("Properties structure:")
         pprint(properties)
         
+        # Columns holding only nulls in the sample default to TEXT
+        column_types = {
+            name: RANKED_SQL_TYPES[rank] if rank >= 0 else "TEXT"
+            for name, rank in type_ranks.items()
+        }
+        print(f"Column types inferred from the first {min(feature_count, TYPE_SAMPLE_SIZE)} features:")
+        pprint(column_types, sort_dicts=False)
+        
         return {
             'feature_count': feature_count,
             'geometry_type': geometry_type,
             'properties': properties,
-            'raw_data': data
+            'column_types': column_types,
+            'source_srid_hint': source_srid_hint,
+            'encoding': encoding
         }
     except Exception as e:
         print(f"Error examining GeoJSON: {e}")
         return None
 
+def _stage_value(value, col_type):
+    """Return the CSV form of a property value for a column of *col_type*."""
+    if value is None:
+        return _NULL_FIELD
+    # bool ranks below int, so a column mixing true and 1 is numeric; csv
+    # would write True, which NUMERIC rejects
+    if isinstance(value, bool) and col_type != "BOOLEAN":
+        return json.dumps(value) if col_type == "TEXT" else int(value)
+    # Nested objects and arrays land in TEXT columns as JSON, not Python reprs
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+def iter_stage_rows(features, column_types):
+    """Yield one staging-table row (property values, then hex WKB) per feature."""
+    for index, feature in enumerate(features):
+        feature_props = feature.get('properties') or {}
+        geometry = feature.get('geometry')
+        values = ((feature_props.get(name), col_type) for name, col_type in column_types.items())
+        # Geometries travel as hex WKB (bytea text form), which PostGIS
+        # decodes far more cheaply than GeoJSON
+        geom_wkb = _NULL_FIELD
+        if geometry:
+            try:
+                geom_wkb = '\\x' + wkb.dumps(shape(geometry), hex=True)
+            except Exception as e:
+                print(f"Error converting geometry of feature {index}, storing NULL: {e}")
+        yield (*(_stage_value(value, col_type) for value, col_type in values), geom_wkb)
+
 def ingest_geojson_to_postgis(file_path, table_name, conn, source_srid=None, target_srid=4326):
     """Ingest GeoJSON data into a new PostGIS table with coordinate system handling."""
     try:
@@ -77,9 +194,7 @@ def ingest_geojson_to_postgis(file_path, table_name, conn, source_srid=None, tar
         if not geojson_info:
             return False
         
-        cursor = conn.cursor()
-        
-        properties = geojson_info['properties']
+        column_types = geojson_info['column_types']
         geometry_type = geojson_info['geometry_type']
         
         postgis_type_map = {
@@ -94,32 +209,22 @@ def ingest_geojson_to_postgis(file_path, table_name, conn, source_srid=None, tar
         postgis_type = postgis_type_map.get(geometry_type, 'GEOMETRY')
         
         if source_srid is None:
-            if 'crs' in geojson_info['raw_data']:
-                crs = geojson_info['raw_data']['crs']
-                if crs.get('type') == 'name' and 'properties' in crs:
-                    name = crs['properties'].get('name', '')
-                    if 'EPSG' in name:
-                        try:
-                            source_srid = int(name.split(':')[-1])
-                            print(f"Detected source SRID: {source_srid}")
-                        except ValueError:
-                            pass
+            source_srid = geojson_info['source_srid_hint']
+            if source_srid is not None:
+                print(f"Detected source SRID: {source_srid}")
             
             if source_srid is None:
                 source_srid = 4326
                 print(f"No CRS specified in GeoJSON. Assuming EPSG:{source_srid}")
         
         columns = []
-        for prop_name, prop_value in properties.items():
-            col_type = "TEXT"
-            if isinstance(prop_value, int):
-                col_type = "INTEGER"
-            elif isinstance(prop_value, float):
-                col_type = "NUMERIC"
-            elif isinstance(prop_value, bool):
-                col_type = "BOOLEAN"
-                
+        stage_columns = []
+        for prop_name, col_type in column_types.items():
             columns.append(f"\"{prop_name}\" {col_type}")
+            # Integer columns are staged as NUMERIC so fractional values still
+            # round on assignment rather than failing the whole COPY
+            stage_type = "NUMERIC" if col_type == "INTEGER" else col_type
+            stage_columns.append(f"\"{prop_name}\" {stage_type}")
         
         columns_sql = ", ".join(columns)
         create_table_sql = f"""
@@ -143,49 +248,121 @@ def ingest_geojson_to_postgis(file_path, table_name, conn, source_srid=None, tar
             print("Operation cancelled by user.")
             return False
         
-        cursor.execute(create_table_sql)
-        
-        features = geojson_info['raw_data']['features']
-        print(f"\nInserting {len(features)} features into the database...")
+        # The whole load is one transaction: committed when the block exits,
+        # rolled back if anything inside it raises
+        if conn.autocommit:
+            conn.autocommit = False
         
-        total = len(features)
-        inserted = 0
-        
-        for feature in features:
-            feature_props = feature.get('properties', {})
+        with conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table_name,))
+            table_exists = cursor.fetchone()[0]
             
-            prop_names = [f"\"{name}\"" for name in feature_props.keys()]
-            placeholders = ["%s"] * len(prop_names)
+            if table_exists:
+                cursor.execute(create_table_sql)
+            else:
+                # New tables are loaded unlogged and without the primary key so the
+                # batches skip WAL and index maintenance; SET LOGGED below then
+                # rewrites the table into WAL once and the key is built in one pass
+                cursor.execute(f"""
+                CREATE UNLOGGED TABLE {table_name} (
+                    id SERIAL,
+                    {columns_sql},
+                    geom GEOMETRY({postgis_type}, {target_srid})
+                );
+                """)
             
-            prop_values = list(feature_props.values())
+            total = geojson_info['feature_count']
+            print(f"\nInserting {total} features into the database...")
             
-            geometry_json = json.dumps(feature.get('geometry', {}))
+            prop_names = list(column_types.keys())
+            quoted_names = ", ".join(f"\"{name}\"" for name in prop_names)
+            # Temp tables live in their own schema, so only the unqualified
+            # part of a schema-qualified name goes into the stage name
+            stage_table = f"stage_{table_name.split('.')[-1]}"
             
-            insert_sql = f"""
-            INSERT INTO {table_name} (
-                {', '.join(prop_names)},
-                geom
-            ) VALUES (
-                {', '.join(placeholders)},
-                ST_Transform(ST_SetSRID(ST_GeomFromGeoJSON(%s), {source_srid}), {target_srid})
-            );
-            """
+            # Collections mixing single and multi parts are promoted to the multi type
+            geom_sql = "ST_Transform(ST_GeomFromWKB(geom_wkb, $1), $2)"
+            if postgis_type.startswith('MULTI'):
+                geom_sql = f"ST_Multi({geom_sql})"
             
-            try:
-                cursor.execute(insert_sql, prop_values + [geometry_json])
-                inserted += 1
-                
-                if inserted % 100 == 0 or inserted == total:
-                    print(f"Progress: {inserted}/{total} features inserted ({int(inserted/total*100)}%)")
-                
-            except Exception as e:
-                print(f"Error inserting feature: {e}")
-                continue
+            # Load the raw rows into a staging table with COPY, then transform
+            # the geometries server-side with an INSERT ... SELECT per batch
+            cursor.execute(f"""
+            CREATE TEMP TABLE {stage_table} (
+                {", ".join(stage_columns)},
+                geom_wkb BYTEA
+            ) ON COMMIT DROP;
+            """)
+            
+            copy_sql = (
+                f"COPY {stage_table} ({quoted_names}, geom_wkb) "
+                f"FROM STDIN WITH (FORMAT CSV, QUOTE '\"', ESCAPE '\"', NULL '{COPY_NULL}')"
+            )
+            
+            # The batch insert is parsed and planned once and executed per batch;
+            # prepared statements outlive transactions, so one left on this
+            # pooled connection by a failed ingest is dropped first
+            cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = 'stage_insert';")
+            if cursor.fetchone():
+                cursor.execute("DEALLOCATE stage_insert;")
+            cursor.execute(f"""
+            PREPARE stage_insert (integer, integer) AS
+            INSERT INTO {table_name} ({quoted_names}, geom)
+            SELECT {quoted_names}, {geom_sql}
+            FROM {stage_table};
+            """)
+            
+            buf = io.StringIO()
+            writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)
+            staged = 0
+            inserted = 0
+            
+            # Second streaming pass: features are read, converted and staged in
+            # BATCH_SIZE pages so the client buffer stays bounded
+            with open_geojson(file_path, geojson_info['encoding']) as f:
+                rows = iter_stage_rows(ijson.items(f, 'features.item', use_float=True), column_types)
+                for batch in iter(lambda: list(itertools.islice(rows, BATCH_SIZE)), []):
+                    writer.writerows(batch)
+                    buf.seek(0)
+                    # A bad batch (in the COPY or in the geometry conversion) is
+                    # rolled back on its own instead of aborting the transaction
+                    # for every batch after it
+                    cursor.execute("SAVEPOINT stage_batch;")
+                    try:
+                        cursor.copy_expert(copy_sql, buf)
+                        cursor.execute("EXECUTE stage_insert (%s, %s);", (source_srid, target_srid))
+                        inserted += cursor.rowcount
+                        cursor.execute(f"TRUNCATE {stage_table};")
+                        cursor.execute("RELEASE SAVEPOINT stage_batch;")
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT stage_batch;")
+                        print(f"Error loading features {staged + 1}-{staged + len(batch)}: {e}")
+                    staged += len(batch)
+                    buf.seek(0)
+                    buf.truncate()
+                    print(f"Progress: {staged}/{total} features processed ({int(staged/total*100)}%)")
+            
+            cursor.execute("DEALLOCATE stage_insert;")
+            
+            if not table_exists:
+                cursor.execute(f"ALTER TABLE {table_name} SET LOGGED;")
+                cursor.execute(f"ALTER TABLE {table_name} ADD PRIMARY KEY (id);")
         
-        conn.commit()
         print(f"\nCompleted: {inserted} out of {total} features inserted successfully.")
         print(f"Data was automatically transformed from EPSG:{source_srid} to EPSG:{target_srid}")
         
+        # Build the spatial index once over the loaded rows; CONCURRENTLY
+        # cannot run inside a transaction block
+        print("\nBuilding spatial index and refreshing statistics...")
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                index_name = f"{table_name.split('.')[-1]}_geom_gix"
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} USING GIST (geom);")
+                cursor.execute(f"ANALYZE {table_name};")
+        finally:
+            conn.autocommit = False
+        
         return True
         
     except Exception as e:
@@ -194,32 +371,31 @@ def ingest_geojson_to_postgis(file_path, table_name, conn, source_srid=None, tar
 
 # Connect to the database
 try:
-    conn = psycopg2.connect(**db_params)
-    
-    # Check PostGIS version
-    cursor = conn.cursor()
-    cursor.execute("SELECT postgis_version();")
-    version = cursor.fetchone()
-    print(f"Connected to PostGIS version: {version[0]}")
-    
-    # Example usage:
-    geojson_file = input("Enter the path to your GeoJSON file: ")
-    if os.path.exists(geojson_file):
-        table_name = input("Enter the name for the PostGIS table: ")
+    with get_conn() as conn:
         
-        # Get coordinate system information
-        source_srid = input("Enter source SRID (press Enter for auto-detection): ")
-        source_srid = int(source_srid) if source_srid and source_srid.isdigit() else None
+        # Check PostGIS version
+        cursor = conn.cursor()
+        cursor.execute("SELECT postgis_version();")
+        version = cursor.fetchone()
+        print(f"Connected to PostGIS version: {version[0]}")
         
-        target_srid = input("Enter target SRID (press Enter for 4326/WGS84): ")
-        target_srid = int(target_srid) if target_srid and target_srid.isdigit() else 4326
+        # Example usage:
+        geojson_file = input("Enter the path to your GeoJSON file: ")
+        if os.path.exists(geojson_file):
+            table_name = input("Enter the name for the PostGIS table: ")
+            
+            # Get coordinate system information
+            source_srid = input("Enter source SRID (press Enter for auto-detection): ")
+            source_srid = int(source_srid) if source_srid and source_srid.isdigit() else None
+            
+            target_srid = input("Enter target SRID (press Enter for 4326/WGS84): ")
+            target_srid = int(target_srid) if target_srid and target_srid.isdigit() else 4326
+            
+            ingest_geojson_to_postgis(geojson_file, table_name, conn, source_srid, target_srid)
+        else:
+            print(f"File not found: {geojson_file}")
         
-        ingest_geojson_to_postgis(geojson_file, table_name, conn, source_srid, target_srid)
-    else:
-        print(f"File not found: {geojson_file}")
-    
-    # Close connection
-    cursor.close()
-    conn.close()
+        # Close cursor; the connection goes back to the pool
+        cursor.close()
 except Exception as e:
     print(f"Error: {e}")
\ No newline at end of file
@@ -1,52 +1,127 @@
-import psycopg2
+import itertools
+
 from tabulate import tabulate
 
-# ---------------------------------------------------------------------------
-# Database configuration
-# ---------------------------------------------------------------------------
+from db import get_pool
 
-db_params = {
-    "dbname": "gisdb",
-    "user": "admin",
-    "password": "admin",
-    "host": "localhost",
-    "port": 5432,
-}
+# Column names per (schema, table); cleared whenever this script alters a table
+_column_cache = {}
 
 def get_actual_column_names(conn, table, schema="public"):
-    """Return the case-sensitive column names for schema.table"""
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            """,
-            (schema, table),
-        )
-        return [r[0] for r in cur.fetchall()]
+    """Return the case-sensitive column names for schema.table
+
+    Cached per (schema, table) so the catalog is queried once per table
+    instead of on every analysis call.
+    """
+    key = (schema, table)
+    if key not in _column_cache:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s
+                """,
+                (schema, table),
+            )
+            _column_cache[key] = tuple(r[0] for r in cur.fetchall())
+    return _column_cache[key]
+
+def clear_column_cache():
+    """Forget cached column names, e.g. after DDL changed a table."""
+    _column_cache.clear()
 
 def connect_to_db():
+    """Borrow a connection from the shared pool and configure its session."""
     try:
-        conn = psycopg2.connect(**db_params)
+        conn = get_pool().getconn()
+        # Let the planner split the dam/plant join across parallel workers;
+        # committed so the setting outlives the current transaction
+        with conn.cursor() as cur:
+            cur.execute("SET max_parallel_workers_per_gather = 4")
+        conn.commit()
         print("Connected to PostgreSQL database.")
         return conn
     except Exception as e:
         print("Error connecting to database:", e)
         return None
 
+def ensure_indexes(conn):
+    """Create the spatial and name indexes the dam/plant queries rely on.
+
+    Only missing indexes are built; if that fails (e.g. a read-only role)
+    the queries still run, just without the index.
+    """
+    dam_cols = get_actual_column_names(conn, "utah_dams")
+    name_col_dam = next(c for c in dam_cols if c.upper() == "NAME")
+    wanted = {
+        "power_plants_geom_gix": "power_plants USING GIST (geom)",
+        "utah_dams_geom_gix": "utah_dams USING GIST (geom)",
+        "utah_dams_name_idx": f'utah_dams ("{name_col_dam}")',
+    }
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND indexname = ANY(%s)",
+            (list(wanted),),
+        )
+        existing = {r[0] for r in cur.fetchall()}
+    missing = {name: target for name, target in wanted.items() if name not in existing}
+    if not missing:
+        conn.commit()
+        return
+
+    try:
+        with conn.cursor() as cur:
+            for name, target in missing.items():
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target};")
+        conn.commit()
+        clear_column_cache()
+    except Exception as e:
+        conn.rollback()
+        print("Could not create indexes, continuing without them:", e)
+
+
+def ensure_area_column(conn):
+    """Store each dam's inundation area (sq km) as an indexed generated column.
+
+    Skipped when the column already exists, so repeat runs take no lock on
+    utah_dams; if the DDL fails (e.g. a read-only role) the areas are
+    computed per query instead.
+    """
+    if "area_sq_km" in get_actual_column_names(conn, "utah_dams"):
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                ALTER TABLE utah_dams
+                    ADD COLUMN IF NOT EXISTS area_sq_km double precision
+                    GENERATED ALWAYS AS (ST_Area(geom::geography) / 1e6) STORED;
+                CREATE INDEX IF NOT EXISTS utah_dams_area_idx ON utah_dams (area_sq_km DESC);
+                """
+            )
+        conn.commit()
+        clear_column_cache()
+    except Exception as e:
+        conn.rollback()
+        print("Could not add area_sq_km to utah_dams, computing areas per query:", e)
+
+
 def list_available_dams(conn, limit=50):
     """Return dams sorted by inundation-polygon area (largest first)."""
     with conn.cursor() as cur:
         dam_cols = get_actual_column_names(conn, "utah_dams")
         name_col = next(c for c in dam_cols if c.upper() == "NAME")
         type_col = next(c for c in dam_cols if c.upper() == "TYPE")
-        geom_col = "geom"
 
+        # area_sq_km is a stored generated column (see ensure_area_column),
+        # so this is an index scan rather than a geodesic area per row;
+        # without it the area is computed on the fly
+        area_sql = "area_sq_km" if "area_sq_km" in dam_cols else "ST_Area(geom::geography) / 1e6"
         cur.execute(
             f"""
-            SELECT "{name_col}", "{type_col}",
-                   ST_Area("{geom_col}"::geography) / 1e6 AS area_sq_km
+            SELECT "{name_col}", "{type_col}", {area_sql} AS area_sq_km
             FROM utah_dams
             ORDER BY area_sq_km DESC
             LIMIT %s
@@ -63,13 +138,22 @@ def list_available_dams(conn, limit=50):
 
 def analyze_power_plants_at_risk(conn, dam_name):
     """Print and return the power plants whose points fall within *dam_name* polygon."""
+    rows = analyze_all_dams(conn, [dam_name])[dam_name]
+    print_plants_at_risk(dam_name, rows)
+    return rows
+
+
+def analyze_all_dams(conn, dam_names=None):
+    """Return {dam name: power-plant rows} from a single dam/plant spatial join.
+
+    Restricted to *dam_names* when given; dams without any plants at risk
+    map to an empty list.
+    """
     with conn.cursor() as cur:
-        # Column discovery – dams
         dam_cols = get_actual_column_names(conn, "utah_dams")
         name_col_dam = next(c for c in dam_cols if c.upper() == "NAME")
         geom_col_dam = "geom"
 
-        # Column discovery – power plants
         pp_cols = get_actual_column_names(conn, "power_plants")
         name_col_pp = next(c for c in pp_cols if c.upper() == "NAME")
         type_col_pp = next(c for c in pp_cols if c.upper() == "TYPE")
@@ -77,27 +161,37 @@ def analyze_power_plants_at_risk(conn, dam_name):
         cap_col = next(c for c in pp_cols if c.upper() == "SUMMER_CAP")
         geom_col_pp = "geom"
 
-        # Spatial query – intersects rather than contains (safer for points)
+        # One join for every dam instead of one query per dam
+        name_filter = f'WHERE  d."{name_col_dam}" = ANY(%s)' if dam_names is not None else ""
         cur.execute(
             f"""
-            SELECT p."{name_col_pp}", p."{type_col_pp}", p."{fuel_col}", p."{cap_col}"
+            SELECT d."{name_col_dam}",
+                   p."{name_col_pp}", p."{type_col_pp}", p."{fuel_col}", p."{cap_col}"
             FROM   utah_dams d
             JOIN   power_plants p
-              ON   ST_Intersects(d."{geom_col_dam}", p."{geom_col_pp}")
-            WHERE  d."{name_col_dam}" = %s
-            ORDER  BY p."{cap_col}" DESC NULLS LAST
+              ON   d."{geom_col_dam}" && p."{geom_col_pp}"
+             AND   ST_Intersects(d."{geom_col_dam}", p."{geom_col_pp}")
+            {name_filter}
+            ORDER  BY d."{name_col_dam}", p."{cap_col}" DESC NULLS LAST
             """,
-            (dam_name,),
+            (list(dam_names),) if dam_names is not None else None,
         )
         rows = cur.fetchall()
 
+    results = {dam: [] for dam in dam_names} if dam_names is not None else {}
+    for dam, group in itertools.groupby(rows, key=lambda r: r[0]):
+        results[dam] = [r[1:] for r in group]
+    return results
+
+
+def print_plants_at_risk(dam_name, rows):
+    """Print the power-plant table for a single dam."""
     print("\n--- Power Plants at Risk ---")
     if rows:
         headers = ["Plant Name", "Type", "Primary Fuel", "Capacity (MW)"]
         print(tabulate(rows, headers, tablefmt="grid"))
     else:
         print(f"No power plants found within the inundation zone of '{dam_name}'.")
-    return rows
 
 
 def main():
@@ -105,6 +199,8 @@ def main():
     assert conn is not None, "Database connection failed."
 
     try:
+        ensure_indexes(conn)
+        ensure_area_column(conn)
         dams = list_available_dams(conn)
         print(
             "\nEnter a dam name to analyze or type 'ALL' for every dam"
@@ -119,11 +215,13 @@ def main():
         else:
             dam_names = [selected]
 
-        for dam in dam_names:
+        plants_by_dam = analyze_all_dams(conn, dam_names)
+
+        for dam, plants in plants_by_dam.items():
             print("\n" + "=" * 60)
             print(f"POWER-PLANT RISK REPORT FOR {dam}")
             print("=" * 60)
-            plants = analyze_power_plants_at_risk(conn, dam)
+            print_plants_at_risk(dam, plants)
             print(
                 f"\nTotal plants at risk: {len(plants)}\n"
             )
@@ -131,7 +229,7 @@ def main():
     except Exception as e:
         print("Error during analysis:", e)
     finally:
-        conn.close()
+        get_pool().putconn(conn)
 
 
 if __name__ == "__main__":